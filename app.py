@@ -4,38 +4,75 @@
 ================================================================================
 This file contains the complete Generative AI implementation for recipe generation.
 Using Google Gemini 2.5 Flash - Latest and Fastest Model
+
+Production: gunicorn -c gunicorn.conf.py app:app
 """
 
+# Must run before anything imports socket/ssl/threading so Gemini HTTPS calls
+# become cooperative under gevent workers
+from gevent import monkey
+monkey.patch_all()
+
 import os
-import json
 import logging
+import atexit
+from logging.handlers import QueueHandler, QueueListener
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, List, Callable, Iterator
 from enum import Enum
-import hashlib
 import time
+import queue
+import threading
+import uuid
+from collections import deque
+from concurrent.futures import Future
+
+import cachetools
+import xxhash
+import orjson
+import json5
+import redis
+from gevent.lock import BoundedSemaphore
+from gevent.pool import Pool
+# pydantic (used by the SDK for response_schema) rejects typing.TypedDict before 3.12
+from typing_extensions import TypedDict
 
 # ==============================================================================
 # GENERATIVE AI IMPORTS - CORE GEN AI
 # ==============================================================================
 import google.generativeai as genai
+from google.generativeai import client as genai_client
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
+from google.generativeai.types import generation_types
+from requests.adapters import HTTPAdapter
 
 # ==============================================================================
 # WEB FRAMEWORK IMPORTS
 # ==============================================================================
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from dotenv import load_dotenv
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator
 
 # ==============================================================================
 # INITIALIZATION
 # ==============================================================================
 load_dotenv()
 
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson for jsonify and request.json"""
+    
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+    
+    def loads(self, s, **kwargs: Any) -> Any:
+        return orjson.loads(s)
+
 app = Flask(__name__, 
             template_folder='templates',
             static_folder='static')
+app.json = OrjsonProvider(app)
 CORS(app)
 
 # ==============================================================================
@@ -46,6 +83,9 @@ class GenAIConfig:
     """Generative AI Configuration - Updated for Gemini 2.5"""
     GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
     
+    # Set GENAI_SMOKE_TEST=1 (or true/yes) to make a test Gemini call at startup
+    SMOKE_TEST = os.getenv("GENAI_SMOKE_TEST", "").strip().lower() in ("1", "true", "yes")
+    
     # Using Gemini 2.5 Flash - Fast and efficient for recipe generation
     # You can also use:
     # - "models/gemini-2.5-pro" for more detailed recipes
@@ -54,13 +94,40 @@ class GenAIConfig:
     GEMINI_MODEL = "models/gemini-2.5-flash"  # Fast and capable
     
     GEMINI_TEMPERATURE = 0.8  # Creativity level (0.0 - 1.0)
-    GEMINI_MAX_TOKENS = 2048  # Maximum response length
+    # gemini-2.5-flash counts its thinking tokens against max_output_tokens and
+    # the pinned SDK has no thinking_config to cap them, so the budget is one
+    # thinking allowance per call plus room for each recipe's JSON
+    GEMINI_THINKING_TOKENS = 3072
+    GEMINI_RECIPE_TOKENS = 900  # Recipe JSON rarely exceeds ~800 tokens
+    GEMINI_MAX_TOKENS = GEMINI_THINKING_TOKENS + GEMINI_RECIPE_TOKENS
+    GEMINI_RETRY_MULTIPLIER = 2  # One retry with double the budget if truncated
     GEMINI_TOP_P = 0.95
-    GEMINI_TOP_K = 40
+    GEMINI_TOP_K = 20
     
     # Rate Limiting
     MAX_REQUESTS_PER_MINUTE = 30
     CACHE_TTL = 3600  # 1 hour
+    CACHE_MAX_SIZE = 1024  # Bounded so long-running workers don't grow without limit
+    
+    # Shared cache + rate limiter across workers; in-process fallback when unset
+    REDIS_URL = os.getenv("REDIS_URL", "")
+    REDIS_MAX_CONNECTIONS = 50
+    # Short timeouts so a hung Redis raises RedisError (-> in-process fallback)
+    # instead of stalling every cache read and rate-limit check
+    REDIS_SOCKET_TIMEOUT = 0.5  # seconds
+    REDIS_POOL_TIMEOUT = 1  # seconds to wait for a free pooled connection
+    
+    # Keep-alive pool for the REST transport - sized for gevent concurrency
+    HTTP_POOL_CONNECTIONS = 20
+    HTTP_POOL_MAXSIZE = 100
+    
+    # Micro-batching of concurrent /generate requests into one Gemini call
+    BATCH_MAX_SIZE = 8
+    BATCH_MAX_LATENCY_MS = 50
+    # Batches per worker that may wait on Gemini at once
+    BATCH_MAX_IN_FLIGHT = 8
+    # Seconds a caller waits for its batch, kept under gunicorn's 120s timeout
+    BATCH_SUBMIT_TIMEOUT = 90
 
 # ==============================================================================
 # ENUMS FOR RECIPE CATEGORIES
@@ -89,6 +156,202 @@ class MealType(str, Enum):
     DINNER = "dinner"
     SNACK = "snack"
 
+# ==============================================================================
+# REQUEST VALIDATION
+# ==============================================================================
+
+class RecipeRequest(BaseModel):
+    """Body of /generate and /generate/stream - bounded so prompts can't be inflated"""
+    model_config = ConfigDict(str_strip_whitespace=True)
+    
+    ingredients: str = Field(min_length=1, max_length=500)
+    cuisine: CuisineType = CuisineType.ANY
+    dietary: DietaryRestriction = DietaryRestriction.NONE
+    meal_type: MealType = MealType.ANY
+    servings: int = Field(default=4, ge=1, le=20)
+    
+    @field_validator('cuisine', 'dietary', 'meal_type', mode='before')
+    @classmethod
+    def blank_means_default(cls, value, info):
+        """The UI sends "" for "Any"/"None" options"""
+        if value is None or (isinstance(value, str) and not value.strip()):
+            return cls.model_fields[info.field_name].default
+        return value.strip().lower() if isinstance(value, str) else value
+
+# ==============================================================================
+# STRUCTURED OUTPUT SCHEMA - GEMINI DECODES STRAIGHT INTO THIS SHAPE
+# ==============================================================================
+
+class IngredientSchema(TypedDict):
+    name: str
+    quantity: str
+    unit: str
+
+class NutritionSchema(TypedDict):
+    calories: str
+    protein: str
+    carbs: str
+    fat: str
+
+class RecipeSchema(TypedDict):
+    name: str
+    description: str
+    prep_time: str
+    cook_time: str
+    total_time: str
+    difficulty: str
+    servings: int
+    ingredients: List[IngredientSchema]
+    instructions: List[str]
+    tips: List[str]
+    nutrition: NutritionSchema
+
+# Must be the builtin list[...] - the SDK's schema converter fails on typing.List
+BATCH_RESPONSE_SCHEMA = list[RecipeSchema]
+
+# ==============================================================================
+# STATIC PROMPT PREFIX - SENT AS THE MODEL'S SYSTEM INSTRUCTION
+# ==============================================================================
+
+RECIPE_SYSTEM_INSTRUCTION = "You are a professional chef."
+
+# The JSON shape comes from RecipeSchema (structured output), not described here.
+# google-generativeai 0.8.3 sends no required list, so any field may be missing
+RECIPE_GUIDELINES = "Build the recipe around the given ingredients; add only basic pantry items (oil, salt, pepper, water). Fill every field. Include chef tips and per-serving nutrition estimates. Times like \"15 minutes\"; difficulty Easy, Medium or Hard."
+
+# Per-request portion, formatted with str.format_map so braces in user input
+# are never interpreted as placeholders
+RECIPE_PROMPT_TEMPLATE = """Ingredients: {ingredients}
+Cuisine: {cuisine}
+Dietary: {dietary}
+Meal: {meal_type}
+Servings: {servings}"""
+
+BATCH_PROMPT_TEMPLATE = """{count} recipes, one per spec, same order.
+
+{sections}"""
+
+# Fields every recipe returned to the UI must have
+REQUIRED_RECIPE_FIELDS = frozenset(('name', 'description', 'prep_time', 'cook_time',
+                                    'ingredients', 'instructions'))
+LIST_RECIPE_FIELDS = frozenset(('ingredients', 'instructions'))
+
+# ==============================================================================
+# LOGGING - WRITES HAPPEN ON A REAL OS THREAD, NOT A GREENLET
+# ==============================================================================
+
+# monkey.patch_all() turns threading.Thread into a greenlet on the worker's only
+# OS thread, where a blocking stderr write would still stall every request.
+# These are the unpatched primitives, safe to share between the two threads.
+# Even the original threading.Thread starts greenlets once _thread is patched,
+# so the listener is started with the unpatched _thread.start_new_thread.
+native_start_new_thread = monkey.get_original('_thread', 'start_new_thread')
+NativeLock = monkey.get_original('_thread', 'allocate_lock')
+NativeRLock = monkey.get_original('_thread', 'RLock')
+NativeSimpleQueue = monkey.get_original('queue', 'SimpleQueue')
+
+class OSThreadQueueListener(QueueListener):
+    """QueueListener whose monitor runs on a native OS thread instead of a greenlet"""
+    
+    def start(self):
+        self._finished = NativeLock()
+        self._finished.acquire()
+        native_start_new_thread(self._run, ())
+    
+    def _run(self):
+        try:
+            self._monitor()
+        finally:
+            self._finished.release()
+    
+    def stop(self):
+        if getattr(self, '_finished', None) is not None:
+            self.enqueue_sentinel()
+            self._finished.acquire()
+            self._finished = None
+
+# ==============================================================================
+# MICRO-BATCHING - COMBINE CONCURRENT REQUESTS INTO ONE GEMINI CALL
+# ==============================================================================
+
+class RecipeBatcher:
+    """
+    Collects recipe specs arriving within a short window and hands them to
+    ``batch_predict`` as one list, then routes each result back to its caller.
+    Each batch runs in its own greenlet, so up to ``max_in_flight`` Gemini
+    calls can be outstanding while the next batch is collected.
+    """
+    
+    def __init__(self, batch_predict: Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]],
+                 max_batch_size: int = GenAIConfig.BATCH_MAX_SIZE,
+                 max_latency_ms: int = GenAIConfig.BATCH_MAX_LATENCY_MS,
+                 max_in_flight: int = GenAIConfig.BATCH_MAX_IN_FLIGHT,
+                 submit_timeout: float = GenAIConfig.BATCH_SUBMIT_TIMEOUT):
+        self.batch_predict = batch_predict
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000.0
+        self.submit_timeout = submit_timeout
+        self.queue = queue.Queue()
+        self.pool = Pool(max_in_flight)
+        self.worker = None
+    
+    def start(self):
+        """Start the collecting loop on first use, so it never runs in the gunicorn master"""
+        if self.worker is None:
+            self.worker = threading.Thread(target=self.run, name="RecipeBatcher", daemon=True)
+            self.worker.start()
+    
+    def submit(self, spec: Dict[str, Any]) -> Dict[str, Any]:
+        """Queue a recipe spec and block until its batch has been generated"""
+        self.start()
+        done = threading.Event()
+        result = {}
+        self.queue.put((spec, done, result))
+        if not done.wait(self.submit_timeout):
+            raise TimeoutError(f"Recipe batch did not finish within {self.submit_timeout}s")
+        
+        if 'error' in result:
+            raise result['error']
+        return result['recipe']
+    
+    def collect_batch(self) -> List[tuple]:
+        """Block for the first item, then gather more until full or the window closes"""
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_latency
+        
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        
+        return batch
+    
+    def run(self):
+        """Background loop - hand each collected batch to the pool and keep collecting"""
+        while True:
+            batch = self.collect_batch()
+            # Blocks only when max_in_flight batches are already waiting on Gemini
+            self.pool.spawn(self.predict_batch, batch)
+    
+    def predict_batch(self, batch: List[tuple]):
+        """One batch_predict call for a collected batch, then wake its callers"""
+        specs = [spec for spec, _, _ in batch]
+        
+        try:
+            recipes = self.batch_predict(specs)
+            for (_, _, result), recipe in zip(batch, recipes):
+                result['recipe'] = recipe
+        except Exception as e:
+            for _, _, result in batch:
+                result['error'] = e
+        
+        for _, done, _ in batch:
+            done.set()
+
 # ==============================================================================
 # GENERATIVE AI SERVICE - CORE IMPLEMENTATION
 # ==============================================================================
@@ -105,30 +368,90 @@ class GenerativeAIService:
         self.setup_logging()
         self.api_key = GenAIConfig.GEMINI_API_KEY
         self.model = None
-        self.request_timestamps = []
-        self.cache = {}
+        self.request_timestamps = deque(maxlen=GenAIConfig.MAX_REQUESTS_PER_MINUTE)
+        self.cache = cachetools.TTLCache(maxsize=GenAIConfig.CACHE_MAX_SIZE, ttl=GenAIConfig.CACHE_TTL)
+        
+        # Greenlets can switch on any I/O, so guard shared state
+        self.rate_limit_lock = BoundedSemaphore(1)
+        self.cache_lock = BoundedSemaphore(1)
+        
+        # Identical requests already waiting on Gemini, keyed by cache key
+        self.inflight: Dict[str, Future] = {}
+        self.inflight_lock = BoundedSemaphore(1)
+        self.redis = self.connect_redis()
         
         # Initialize Gemini
         self.initialize_gemini()
+        self.batch_size = GenAIConfig.BATCH_MAX_SIZE if self.check_batch_schema() else 1
+        self.batcher = RecipeBatcher(self.generate_recipe_batch, max_batch_size=self.batch_size)
         
         self.logger.info("✅ Generative AI Service initialized with Gemini 2.5")
     
+    def after_fork(self):
+        """Reset per-process state inherited from the gunicorn master (--preload)"""
+        # Only the forking thread survives fork, so the log listener's OS thread
+        # is gone. The batcher has not started (it starts on first submit), but
+        # each worker gets its own queue and pool, and pooled sockets must not
+        # be shared between workers - the model and caches are kept.
+        # Fresh log queue so records still queued in the master aren't printed twice
+        self.queue_handler.queue = NativeSimpleQueue()
+        self.start_log_listener()
+        self.batcher = RecipeBatcher(self.generate_recipe_batch, max_batch_size=self.batch_size)
+        self.configure_connection_pool()
+    
+    def connect_redis(self):
+        """Connect to Redis when REDIS_URL is set, so all workers share one cache and rate limit"""
+        if not GenAIConfig.REDIS_URL:
+            return None
+        
+        pool = redis.BlockingConnectionPool.from_url(
+            GenAIConfig.REDIS_URL,
+            max_connections=GenAIConfig.REDIS_MAX_CONNECTIONS,
+            timeout=GenAIConfig.REDIS_POOL_TIMEOUT,
+            socket_timeout=GenAIConfig.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=GenAIConfig.REDIS_SOCKET_TIMEOUT,
+            decode_responses=True
+        )
+        self.logger.info("🗃️ Using Redis for recipe cache and rate limiting")
+        return redis.Redis(connection_pool=pool)
+    
     def setup_logging(self):
         """Setup logging for GenAI service"""
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
+        # Request greenlets only enqueue records; a listener on a real OS thread
+        # does the blocking stderr writes
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        ))
+        # Only the listener thread uses this handler - give it a native lock, not a gevent one
+        stream_handler.lock = NativeRLock()
+        
+        self.log_handlers = (stream_handler,)
+        self.queue_handler = QueueHandler(NativeSimpleQueue())
+        self.start_log_listener()
+        atexit.register(lambda: self.log_listener.stop())
+        
+        root_logger = logging.getLogger()
+        root_logger.setLevel(logging.INFO)
+        root_logger.addHandler(self.queue_handler)
         self.logger = logging.getLogger("GenerativeAI")
     
+    def start_log_listener(self):
+        """Start the OS thread that drains the log queue into the real handlers"""
+        self.log_listener = OSThreadQueueListener(self.queue_handler.queue, *self.log_handlers,
+                                                  respect_handler_level=True)
+        self.log_listener.start()
+    
     def initialize_gemini(self):
         """Initialize Google Gemini AI with Gemini 2.5"""
         try:
             if not self.api_key:
                 raise ValueError("GEMINI_API_KEY not found in environment variables")
             
-            # Configure Gemini
-            genai.configure(api_key=self.api_key)
+            # Configure Gemini - REST goes through requests/urllib3, which gevent
+            # patches; the default gRPC transport would block the whole worker
+            genai.configure(api_key=self.api_key, transport="rest")
+            self.configure_connection_pool()
             
             self.logger.info(f"📡 Connecting to Gemini model: {GenAIConfig.GEMINI_MODEL}")
             
@@ -146,38 +469,142 @@ class GenerativeAIService:
                 "top_p": GenAIConfig.GEMINI_TOP_P,
                 "top_k": GenAIConfig.GEMINI_TOP_K,
                 "max_output_tokens": GenAIConfig.GEMINI_MAX_TOKENS,
+                "response_mime_type": "application/json",
+                "response_schema": RecipeSchema,
             }
             
-            # Initialize the model with Gemini 2.5 Flash
+            # Initialize the model with Gemini 2.5 Flash. The static prefix is far
+            # below the 1024-token minimum for Gemini context caching, so it is
+            # sent as a system instruction
             self.model = genai.GenerativeModel(
                 model_name=GenAIConfig.GEMINI_MODEL,
                 generation_config=self.generation_config,
-                safety_settings=self.safety_settings
+                safety_settings=self.safety_settings,
+                system_instruction=f"{RECIPE_SYSTEM_INSTRUCTION}\n\n{RECIPE_GUIDELINES}"
             )
             
-            # Quick test
-            test_response = self.model.generate_content("Generate a simple recipe name")
-            self.logger.info(f"✅ Gemini 2.5 connected successfully")
+            # Optional live round-trip - off by default so boots don't spend quota
+            if GenAIConfig.SMOKE_TEST:
+                self.model.generate_content("Generate a simple recipe name")
+                self.logger.info(f"✅ Gemini 2.5 connected successfully")
             
         except Exception as e:
             self.logger.error(f"❌ Failed to initialize Gemini AI: {str(e)}")
             raise
     
+    def configure_connection_pool(self):
+        """Widen the REST client's keep-alive pool so TLS connections are reused"""
+        # requests' default pool keeps only 10 connections per host; extra
+        # concurrent calls would handshake a fresh TLS connection and discard it
+        try:
+            session = getattr(genai_client.get_default_generative_client()._transport, '_session', None)
+            if session is None:
+                self.logger.warning("Could not configure Gemini connection pool: REST transport has no requests session")
+                return
+            
+            session.mount("https://", HTTPAdapter(
+                pool_connections=GenAIConfig.HTTP_POOL_CONNECTIONS,
+                pool_maxsize=GenAIConfig.HTTP_POOL_MAXSIZE
+            ))
+            self.logger.info(f"🔌 Gemini connection pool size: {GenAIConfig.HTTP_POOL_MAXSIZE}")
+        except Exception as e:
+            self.logger.warning(f"Could not configure Gemini connection pool: {e}")
+    
+    def call_model(self, prompt: str, generation_config: Dict[str, Any] = None, stream: bool = False):
+        """Single place every Gemini generate_content call goes through"""
+        return self.model.generate_content(prompt, generation_config=generation_config, stream=stream)
+    
+    def check_batch_schema(self) -> bool:
+        """Convert the single and batch response schemas locally so a bad schema fails at boot"""
+        try:
+            for schema in (RecipeSchema, BATCH_RESPONSE_SCHEMA):
+                generation_types.to_generation_config_dict(
+                    dict(self.generation_config, response_schema=schema)
+                )
+            return True
+        except Exception as e:
+            # Batches of 2+ would always fall back - generate one recipe per call instead
+            self.logger.error(f"❌ Batch response schema rejected, disabling micro-batching: {e}")
+            return False
+    
+    def hit_token_limit(self, response) -> bool:
+        """True if Gemini stopped because it ran out of output tokens"""
+        candidates = getattr(response, 'candidates', None)
+        if not candidates:
+            return False
+        return getattr(candidates[0].finish_reason, 'name', str(candidates[0].finish_reason)) == "MAX_TOKENS"
+    
+    def budget_config(self, recipe_count: int = 1, retry: bool = False) -> Dict[str, Any]:
+        """Generation config sized for recipe_count recipes (larger budget on retry)"""
+        max_tokens = GenAIConfig.GEMINI_THINKING_TOKENS + GenAIConfig.GEMINI_RECIPE_TOKENS * recipe_count
+        if retry:
+            max_tokens *= GenAIConfig.GEMINI_RETRY_MULTIPLIER
+        config = dict(self.generation_config, max_output_tokens=max_tokens)
+        if recipe_count > 1:
+            config['response_schema'] = BATCH_RESPONSE_SCHEMA
+        return config
+    
+    def generate_with_retry(self, prompt: str, recipe_count: int = 1):
+        """Call Gemini with a tight token budget, retrying once with more room if truncated"""
+        response = self.call_model(prompt, generation_config=self.budget_config(recipe_count))
+        
+        if self.hit_token_limit(response):
+            self.logger.warning("⚠️ Response hit max_output_tokens, retrying with a larger budget")
+            response = self.call_model(prompt, generation_config=self.budget_config(recipe_count, retry=True))
+        
+        return response
+    
     def check_rate_limit(self):
         """Implement rate limiting"""
+        if self.redis is not None:
+            try:
+                return self.check_shared_rate_limit()
+            except redis.RedisError as e:
+                self.logger.warning(f"Redis rate limit unavailable, using local window: {e}")
+        
+        with self.rate_limit_lock:
+            current_time = time.time()
+            
+            # Timestamps are appended in order, so expired ones are always on the left
+            while self.request_timestamps and current_time - self.request_timestamps[0] >= 60:
+                self.request_timestamps.popleft()
+            
+            if len(self.request_timestamps) >= GenAIConfig.MAX_REQUESTS_PER_MINUTE:
+                return False
+            
+            self.request_timestamps.append(current_time)
+            return True
+    
+    def check_shared_rate_limit(self) -> bool:
+        """Sliding-window rate limit in a Redis sorted set shared by every worker"""
         current_time = time.time()
-        self.request_timestamps = [t for t in self.request_timestamps if current_time - t < 60]
+        member = f"{current_time}:{uuid.uuid4().hex}"
         
-        if len(self.request_timestamps) >= GenAIConfig.MAX_REQUESTS_PER_MINUTE:
-            return False
+        # Record this request first, then count, so concurrent workers can't both slip under the limit
+        pipe = self.redis.pipeline()
+        pipe.zremrangebyscore("ratelimit", 0, current_time - 60)
+        pipe.zadd("ratelimit", {member: current_time})
+        pipe.zcard("ratelimit")
+        pipe.expire("ratelimit", 60)
+        _, _, request_count, _ = pipe.execute()
         
-        self.request_timestamps.append(current_time)
+        if request_count > GenAIConfig.MAX_REQUESTS_PER_MINUTE:
+            self.redis.zrem("ratelimit", member)
+            return False
         return True
     
     def generate_cache_key(self, ingredients: str, cuisine: str, dietary: str, meal_type: str, servings: int) -> str:
-        """Generate cache key from request parameters"""
-        content = f"{ingredients}_{cuisine}_{dietary}_{meal_type}_{servings}"
-        return hashlib.md5(content.encode()).hexdigest()
+        """Generate cache key from normalized request parameters"""
+        # Normalize so "Tomato, chicken" and "chicken,tomato " share an entry
+        normalized_ingredients = ",".join(sorted(i.strip().lower() for i in ingredients.split(",")))
+        content = "_".join([
+            normalized_ingredients,
+            (cuisine or "").strip().lower(),
+            (dietary or "").strip().lower(),
+            (meal_type or "").strip().lower(),
+            str(servings),
+        ])
+        return xxhash.xxh3_64_hexdigest(content)
     
     # ============================================================================
     # CORE GEN AI METHOD - PROMPT ENGINEERING
@@ -190,50 +617,48 @@ class GenerativeAIService:
         ============================================================================
         """
         
-        prompt = f"""You are an expert professional chef. Create a delicious recipe using these ingredients: {ingredients}
-
-RECIPE REQUIREMENTS:
-- Cuisine: {cuisine if cuisine != 'any' else 'Any cuisine'}
-- Dietary: {dietary if dietary else 'None'}
-- Meal Type: {meal_type if meal_type else 'Any'}
-- Servings: {servings} people
-
-GUIDELINES:
-1. Use the provided ingredients as main components
-2. Only add essential pantry items (oil, salt, pepper, water) if needed
-3. Make instructions clear and easy to follow
-4. Include professional chef tips
-5. Provide nutritional estimates
-
-Return the recipe in this EXACT JSON format:
-{{
-    "name": "Creative recipe name",
-    "description": "Brief appetizing description",
-    "prep_time": "X minutes",
-    "cook_time": "Y minutes",
-    "total_time": "X+Y minutes",
-    "difficulty": "Easy/Medium/Hard",
-    "servings": {servings},
-    "ingredients": [
-        {{"name": "ingredient 1", "quantity": "amount", "unit": "unit"}},
-        {{"name": "ingredient 2", "quantity": "amount", "unit": "unit"}}
-    ],
-    "instructions": [
-        "Step 1: ...",
-        "Step 2: ..."
-    ],
-    "tips": ["Tip 1", "Tip 2"],
-    "nutrition": {{
-        "calories": "approx per serving",
-        "protein": "approx grams",
-        "carbs": "approx grams",
-        "fat": "approx grams"
-    }}
-}}
-
-Return ONLY the JSON, no other text."""
-        
-        return prompt
+        # Only the variable portion - instructions live in the system instruction
+        return RECIPE_PROMPT_TEMPLATE.format_map({
+            'ingredients': ingredients,
+            'cuisine': cuisine if cuisine != 'any' else 'Any',
+            'dietary': dietary if dietary else 'None',
+            'meal_type': meal_type if meal_type else 'Any',
+            'servings': servings
+        })
+    
+    def build_batch_prompt(self, specs: List[Dict[str, Any]]) -> str:
+        """Combine several recipe specs into one prompt asking for a JSON array"""
+        sections = [
+            f"RECIPE {index}:\n{self.build_recipe_prompt(**spec)}"
+            for index, spec in enumerate(specs, start=1)
+        ]
+        
+        return BATCH_PROMPT_TEMPLATE.format_map({
+            'count': len(specs),
+            'sections': "\n\n".join(sections)
+        })
+    
+    def load_json(self, response_text: str) -> Any:
+        """Parse model JSON - orjson fast path, json5 for trailing commas/comments/single quotes"""
+        try:
+            return orjson.loads(response_text)
+        except orjson.JSONDecodeError as strict_error:
+            try:
+                parsed = json5.loads(response_text)
+            except ValueError:
+                raise strict_error
+            self.logger.info("♻️ Recovered malformed Gemini JSON with json5")
+            return parsed
+    
+    def ensure_required_fields(self, recipe_dict: Dict[str, Any]) -> Dict[str, Any]:
+        """Fill in any required recipe fields the model left out"""
+        if not isinstance(recipe_dict, dict):
+            raise ValueError(f"expected a recipe object, got {type(recipe_dict).__name__}")
+        
+        for field in REQUIRED_RECIPE_FIELDS - recipe_dict.keys():
+            recipe_dict[field] = [] if field in LIST_RECIPE_FIELDS else "Not specified"
+        
+        return recipe_dict
     
     def parse_recipe_response(self, response_text: str, original_ingredients: str) -> Dict[str, Any]:
         """
@@ -243,36 +668,33 @@ Return ONLY the JSON, no other text."""
         """
         
         try:
-            # Clean response
-            cleaned_text = response_text.strip()
-            
-            # Remove markdown if present
-            if "```json" in cleaned_text:
-                cleaned_text = cleaned_text.split("```json")[1].split("```")[0].strip()
-            elif "```" in cleaned_text:
-                cleaned_text = cleaned_text.split("```")[1].split("```")[0].strip()
-            
-            # Parse JSON
-            recipe_dict = json.loads(cleaned_text)
+            # Parse JSON - structured output means no markdown to strip
+            recipe_dict = self.load_json(response_text)
             
             # Ensure required fields
-            required_fields = ['name', 'description', 'prep_time', 'cook_time', 
-                              'ingredients', 'instructions']
+            return self.ensure_required_fields(recipe_dict)
             
-            for field in required_fields:
-                if field not in recipe_dict:
-                    if field == 'ingredients':
-                        recipe_dict[field] = []
-                    elif field == 'instructions':
-                        recipe_dict[field] = []
-                    else:
-                        recipe_dict[field] = "Not specified"
+        except Exception as e:
+            self.logger.error(f"Parse error: {e}")
+            return self.mark_fallback(self.create_fallback_recipe(original_ingredients))
+    
+    def parse_batch_response(self, response_text: str, specs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Split a batched JSON array response back into one recipe per spec"""
+        try:
+            recipes = self.load_json(response_text)
+            if not isinstance(recipes, list) or len(recipes) != len(specs):
+                raise ValueError(f"expected {len(specs)} recipes, got {len(recipes) if isinstance(recipes, list) else 'non-list'}")
             
-            return recipe_dict
+            return [self.ensure_required_fields(recipe) for recipe in recipes]
             
         except Exception as e:
-            self.logger.error(f"Parse error: {e}")
-            return self.create_fallback_recipe(original_ingredients)
+            self.logger.error(f"Batch parse error: {e}")
+            return [self.mark_fallback(self.create_fallback_recipe(spec['ingredients'])) for spec in specs]
+    
+    def mark_fallback(self, recipe: Dict[str, Any]) -> Dict[str, Any]:
+        """Flag a parse-failure recipe so it is never cached; callers pop the flag before returning"""
+        recipe['fallback'] = True
+        return recipe
     
     def create_fallback_recipe(self, ingredients: str) -> Dict[str, Any]:
         """Create a fallback recipe when AI parsing fails"""
@@ -310,6 +732,44 @@ Return ONLY the JSON, no other text."""
     # MAIN GENERATIVE AI METHOD
     # ============================================================================
     
+    def get_cached_recipe(self, cache_key: str):
+        """Return the cached recipe for this key, or None"""
+        if self.redis is not None:
+            try:
+                cached = self.redis.get(f"recipe:{cache_key}")
+                return orjson.loads(cached) if cached else None
+            except redis.RedisError as e:
+                self.logger.warning(f"Redis cache read failed: {e}")
+        
+        with self.cache_lock:
+            return self.cache.get(cache_key)
+    
+    def store_recipe(self, cache_key: str, recipe: Dict[str, Any], ingredients: str) -> Dict[str, Any]:
+        """Attach generation metadata and cache the recipe"""
+        recipe['generated_at'] = datetime.now().isoformat()
+        recipe['model_used'] = "Gemini 2.5 Flash"
+        recipe['ingredients_used'] = ingredients
+        
+        # Cache the result (TTLCache / SETEX expire it automatically)
+        if self.redis is not None:
+            try:
+                self.redis.setex(f"recipe:{cache_key}", GenAIConfig.CACHE_TTL, orjson.dumps(recipe))
+            except redis.RedisError as e:
+                self.logger.warning(f"Redis cache write failed: {e}")
+        
+        with self.cache_lock:
+            self.cache[cache_key] = recipe
+        
+        self.logger.info(f"✅ Recipe generated: {recipe.get('name')}")
+        return recipe
+    
+    def rate_limited_recipe(self) -> Dict[str, Any]:
+        """Response returned when the per-minute Gemini quota is used up"""
+        return {
+            "error": "Rate limit reached. Please wait a minute.",
+            "name": "Rate Limit Exceeded"
+        }
+    
     def generate_recipe(self, ingredients: str, cuisine: str = "any", 
                        dietary: str = "", meal_type: str = "", servings: int = 4) -> Dict[str, Any]:
         """
@@ -322,47 +782,132 @@ Return ONLY the JSON, no other text."""
         
         # Check cache
         cache_key = self.generate_cache_key(ingredients, cuisine, dietary, meal_type, servings)
-        if cache_key in self.cache:
-            cache_time, cached_recipe = self.cache[cache_key]
-            if time.time() - cache_time < GenAIConfig.CACHE_TTL:
-                self.logger.info("Returning cached recipe")
-                return cached_recipe
+        cached_recipe = self.get_cached_recipe(cache_key)
+        if cached_recipe is not None:
+            self.logger.info("Returning cached recipe")
+            return cached_recipe
+        
+        # Coalesce identical concurrent requests onto a single Gemini call
+        with self.inflight_lock:
+            pending = self.inflight.get(cache_key)
+            if pending is None:
+                future = Future()
+                self.inflight[cache_key] = future
         
+        if pending is not None:
+            self.logger.info("Joining in-flight request for the same recipe")
+            try:
+                return pending.result()
+            except Exception:
+                return self.create_fallback_recipe(ingredients)
+        
+        try:
+            recipe = self.generate_uncached_recipe(cache_key, ingredients, cuisine, dietary, meal_type, servings)
+            future.set_result(recipe)
+            return recipe
+            
+        except Exception as e:
+            future.set_exception(e)
+            self.logger.error(f"Recipe generation failed: {e}")
+            return self.create_fallback_recipe(ingredients)
+            
+        finally:
+            with self.inflight_lock:
+                self.inflight.pop(cache_key, None)
+    
+    def generate_uncached_recipe(self, cache_key: str, ingredients: str, cuisine: str,
+                                 dietary: str, meal_type: str, servings: int) -> Dict[str, Any]:
+        """Rate-limit, queue for the next Gemini batch and cache the result"""
         # Check rate limit
         if not self.check_rate_limit():
-            return {
-                "error": "Rate limit reached. Please wait a minute.",
-                "name": "Rate Limit Exceeded"
-            }
+            return self.rate_limited_recipe()
+        
+        # Queue for the next Gemini batch and wait for our recipe
+        recipe = self.batcher.submit({
+            'ingredients': ingredients,
+            'cuisine': cuisine,
+            'dietary': dietary,
+            'meal_type': meal_type,
+            'servings': servings
+        })
+        
+        # A failed parse (possibly of a whole batch) must not stick for CACHE_TTL
+        if recipe.pop('fallback', False):
+            return recipe
+        
+        return self.store_recipe(cache_key, recipe, ingredients)
+    
+    def stream_recipe(self, ingredients: str, cuisine: str = "any", 
+                      dietary: str = "", meal_type: str = "", servings: int = 4) -> Iterator[Dict[str, Any]]:
+        """
+        Streaming variant of generate_recipe. Yields {"chunk": text} as Gemini
+        decodes, then a final {"recipe": {...}} once the full JSON is parsed.
+        """
+        
+        self.logger.info(f"Streaming recipe for: {ingredients}")
+        
+        cache_key = self.generate_cache_key(ingredients, cuisine, dietary, meal_type, servings)
+        cached_recipe = self.get_cached_recipe(cache_key)
+        if cached_recipe is not None:
+            self.logger.info("Returning cached recipe")
+            yield {'recipe': cached_recipe}
+            return
+        
+        if not self.check_rate_limit():
+            yield {'recipe': self.rate_limited_recipe()}
+            return
         
         try:
-            # Build prompt
             prompt = self.build_recipe_prompt(ingredients, cuisine, dietary, meal_type, servings)
             
-            self.logger.info("📤 Sending request to Gemini 2.5...")
+            self.logger.info("📤 Streaming request to Gemini 2.5...")
+            response = self.call_model(prompt, stream=True)
             
-            # Call Gemini API
-            response = self.model.generate_content(prompt)
+            parts = []
+            for chunk in response:
+                # Metadata-only chunks have no candidates, and .parts raises on them
+                if not chunk.candidates or not chunk.candidates[0].content.parts:
+                    continue
+                parts.append(chunk.text)
+                yield {'chunk': chunk.text}
             
-            self.logger.info("📥 Received response from Gemini 2.5")
+            self.logger.info("📥 Gemini 2.5 stream complete")
+            response_text = "".join(parts)
             
-            # Parse response
-            recipe = self.parse_recipe_response(response.text, ingredients)
+            # Same one-shot MAX_TOKENS retry as the batched path, without streaming
+            if self.hit_token_limit(response):
+                self.logger.warning("⚠️ Stream hit max_output_tokens, retrying with a larger budget")
+                response_text = self.call_model(prompt, generation_config=self.budget_config(retry=True)).text
             
-            # Add metadata
-            recipe['generated_at'] = datetime.now().isoformat()
-            recipe['model_used'] = "Gemini 2.5 Flash"
-            recipe['ingredients_used'] = ingredients
+            recipe = self.parse_recipe_response(response_text, ingredients)
+            if not recipe.pop('fallback', False):
+                recipe = self.store_recipe(cache_key, recipe, ingredients)
+            yield {'recipe': recipe}
             
-            # Cache the result
-            self.cache[cache_key] = (time.time(), recipe)
+        except Exception as e:
+            self.logger.error(f"Recipe streaming failed: {e}")
+            yield {'recipe': self.create_fallback_recipe(ingredients)}
+    
+    def generate_recipe_batch(self, specs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Generate recipes for a batch of specs with a single Gemini call"""
+        if len(specs) == 1:
+            spec = specs[0]
+            prompt = self.build_recipe_prompt(**spec)
             
-            self.logger.info(f"✅ Recipe generated: {recipe.get('name')}")
-            return recipe
+            self.logger.info("📤 Sending request to Gemini 2.5...")
+            response = self.generate_with_retry(prompt)
+            self.logger.info("📥 Received response from Gemini 2.5")
             
-        except Exception as e:
-            self.logger.error(f"Recipe generation failed: {e}")
-            return self.create_fallback_recipe(ingredients)
+            return [self.parse_recipe_response(response.text, spec['ingredients'])]
+        
+        prompt = self.build_batch_prompt(specs)
+        
+        # Token budget scales with the number of recipes in the array
+        self.logger.info(f"📤 Sending batch of {len(specs)} requests to Gemini 2.5...")
+        response = self.generate_with_retry(prompt, recipe_count=len(specs))
+        self.logger.info("📥 Received batch response from Gemini 2.5")
+        
+        return self.parse_batch_response(response.text, specs)
 
 # ==============================================================================
 # INITIALIZE GENERATIVE AI SERVICE
@@ -385,6 +930,26 @@ def index():
     """Render the main webpage"""
     return render_template('index.html')
 
+def parse_generate_request() -> Dict[str, Any]:
+    """Validate the request body and return recipe parameters (raises ValidationError)"""
+    recipe_request = RecipeRequest.model_validate(request.get_json(silent=True))
+    return recipe_request.model_dump(mode='json')
+
+def validation_error_response(error: ValidationError):
+    """400 response with a readable message for the UI plus the full error list"""
+    first = error.errors()[0]
+    field = ".".join(str(part) for part in first['loc']) or 'body'
+    
+    if first['loc'] == ('ingredients',) and first['type'] in ('missing', 'string_too_short'):
+        message = 'Please enter ingredients'
+    else:
+        message = f"{field}: {first['msg']}"
+    
+    return jsonify({
+        'error': message,
+        'details': error.errors(include_url=False, include_context=False)
+    }), 400
+
 @app.route('/generate', methods=['POST'])
 def generate_recipe():
     """Generate recipe using Gemini 2.5 AI"""
@@ -393,29 +958,38 @@ def generate_recipe():
         return jsonify({'error': 'AI service not initialized. Check API key.'}), 503
     
     try:
-        data = request.json
-        ingredients = data.get('ingredients', '').strip()
-        cuisine = data.get('cuisine', 'any')
-        dietary = data.get('dietary', '')
-        meal_type = data.get('meal_type', '')
-        servings = int(data.get('servings', 4))
-        
-        if not ingredients:
-            return jsonify({'error': 'Please enter ingredients'}), 400
-        
-        recipe = genai_service.generate_recipe(
-            ingredients=ingredients,
-            cuisine=cuisine,
-            dietary=dietary,
-            meal_type=meal_type,
-            servings=servings
-        )
+        params = parse_generate_request()
+        
+        recipe = genai_service.generate_recipe(**params)
         
         return jsonify(recipe)
         
+    except ValidationError as e:
+        return validation_error_response(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/generate/stream', methods=['POST'])
+def stream_recipe():
+    """Stream recipe generation as newline-delimited JSON"""
+    
+    if not genai_service:
+        return jsonify({'error': 'AI service not initialized. Check API key.'}), 503
+    
+    try:
+        params = parse_generate_request()
+        
+    except ValidationError as e:
+        return validation_error_response(e)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    
+    def generate():
+        for event in genai_service.stream_recipe(**params):
+            yield app.json.dumps(event) + "\n"
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 @app.route('/health')
 def health():
     """Health check endpoint"""
@@ -0,0 +1,26 @@
+# gunicorn.conf.py
+# Run with: gunicorn -c gunicorn.conf.py app:app
+#
+# Gemini calls are I/O-bound, so gevent workers let hundreds of in-flight
+# requests share one process instead of blocking on each HTTPS round-trip.
+
+bind = "0.0.0.0:5000"
+
+worker_class = "gevent"
+workers = 4
+worker_connections = 1000
+
+# Gemini responses can take several seconds; don't kill workers mid-request
+timeout = 120
+
+# Build GenerativeAIService once in the master and share it copy-on-write,
+# instead of re-initialising the Gemini SDK in every worker
+preload_app = True
+
+
+def post_fork(server, worker):
+    """Give each worker its own batcher, log listener and connection pool"""
+    from app import genai_service
+
+    if genai_service is not None:
+        genai_service.after_fork()
@@ -48,8 +48,8 @@ async function generateRecipe() {
     hideEmptyState();
 
     try {
-        // Call the Generative AI backend
-        const response = await fetch('/generate', {
+        // Call the streaming Generative AI backend
+        const response = await fetch('/generate/stream', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -63,13 +63,23 @@ async function generateRecipe() {
             })
         });
 
-        const recipe = await response.json();
+        // Validation errors come back as a single JSON object
+        if (!response.ok) {
+            const error = await response.json();
+            showLoading(false);
+            showError(error.error || 'Error connecting to Generative AI. Please try again.');
+            return;
+        }
+
+        const recipe = await readRecipeStream(response);
 
         // Hide loading
         showLoading(false);
 
         // Display recipe
-        if (recipe.error) {
+        if (!recipe) {
+            showError('Error connecting to Generative AI. Please try again.');
+        } else if (recipe.error) {
             showError(recipe.error);
         } else {
             displayRecipe(recipe);
@@ -82,6 +92,127 @@ async function generateRecipe() {
     }
 }
 
+/**
+ * Read the NDJSON stream from /generate/stream.
+ * Shows a preview as text arrives and resolves with the final recipe.
+ */
+async function readRecipeStream(response) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let streamedText = '';
+    let recipe = null;
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+
+        for (const line of lines) {
+            if (!line.trim()) continue;
+            const event = JSON.parse(line);
+
+            if (event.chunk) {
+                streamedText += event.chunk;
+                showStreamingPreview(streamedText);
+            } else if (event.recipe) {
+                recipe = event.recipe;
+            }
+        }
+    }
+
+    if (buffer.trim()) {
+        const event = JSON.parse(buffer);
+        if (event.recipe) recipe = event.recipe;
+    }
+
+    return recipe;
+}
+
+/**
+ * Render the recipe name and description as soon as they appear in the stream
+ */
+function showStreamingPreview(partialJson) {
+    const name = extractStreamedField(partialJson, 'name');
+    if (!name) return;
+
+    const description = extractStreamedField(partialJson, 'description');
+    const outputDiv = document.getElementById('recipe-output');
+    outputDiv.innerHTML = `
+        <div class="recipe-card">
+            <div class="recipe-header">
+                <h2><i class="fas fa-utensils"></i> ${name}</h2>
+                <p class="recipe-description">${description || ''}</p>
+            </div>
+        </div>
+    `;
+}
+
+/**
+ * Pull a completed top-level string field out of partially streamed JSON.
+ * Only keys at depth 1 count - Gemini may stream "ingredients" before "name",
+ * and an ingredient's "name" must not be taken for the recipe's.
+ */
+function extractStreamedField(partialJson, field) {
+    let depth = 0;
+    let i = 0;
+
+    while (i < partialJson.length) {
+        const ch = partialJson[i];
+
+        if (ch === '"') {
+            const end = findStringEnd(partialJson, i);
+            if (end === -1) return null;
+
+            const token = partialJson.slice(i, end + 1);
+            i = end + 1;
+
+            // Keys are followed by a colon; string values never are
+            const colon = partialJson.slice(i).match(/^\s*:\s*/);
+            if (depth !== 1 || !colon) continue;
+            i += colon[0].length;
+
+            if (parseStreamedString(token) !== field) continue;
+            if (partialJson[i] !== '"') return null;
+
+            const valueEnd = findStringEnd(partialJson, i);
+            if (valueEnd === -1) return null;
+            return parseStreamedString(partialJson.slice(i, valueEnd + 1));
+        }
+
+        if (ch === '{' || ch === '[') depth++;
+        else if (ch === '}' || ch === ']') depth--;
+        i++;
+    }
+
+    return null;
+}
+
+/**
+ * Index of the quote closing the JSON string that opens at start, or -1
+ */
+function findStringEnd(text, start) {
+    for (let i = start + 1; i < text.length; i++) {
+        if (text[i] === '\\') i++;
+        else if (text[i] === '"') return i;
+    }
+    return -1;
+}
+
+/**
+ * Decode a complete JSON string token, falling back to its raw contents
+ */
+function parseStreamedString(token) {
+    try {
+        return JSON.parse(token);
+    } catch (error) {
+        return token.slice(1, -1);
+    }
+}
+
 /**
  * Display the generated recipe in the UI
  */